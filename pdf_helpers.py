@@ -0,0 +1,190 @@
+"""
+Helpers for streamlit_app.py that must live in a normally imported module.
+
+Streamlit re-executes the app script in a fresh ``__main__`` module on every
+run, so functions defined there cannot be pickled reliably for worker
+processes, and module-level state there does not survive a rerun.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import fitz  # PyMuPDF
+
+# Upper bound on rendering worker processes for the whole server
+_MAX_WORKERS = 4
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# Sessions holding each spooled PDF. Identical uploads share one spool file,
+# so it is only removed once the last session holding it lets go.
+_spool_refs = {}
+_spool_lock = threading.RLock()
+
+
+def _hash_pdf_bytes(pdf_bytes):
+    """
+    Content hash used to name the spooled PDF, and so to key the caches.
+
+    SHA-256 goes through OpenSSL, which uses the CPU's SHA extensions where
+    available and outpaces hashlib's own BLAKE2 on large uploads.
+    """
+    return hashlib.sha256(pdf_bytes).digest()
+
+
+def spool_upload(uploaded_file):
+    """
+    Spool an uploaded PDF to a content-addressed temp file and return its path.
+
+    Every operation opens this file instead of passing the PDF bytes around,
+    and because the path embeds the content hash it doubles as the cache key
+    for the operations. Each call takes a reference on the file that must be
+    released with ``discard_spool``.
+    """
+    with uploaded_file.getbuffer() as pdf_buffer:
+        digest = _hash_pdf_bytes(pdf_buffer).hex()
+    pdf_path = os.path.join(tempfile.gettempdir(), f"st-pdf-foundry-{digest}.pdf")
+
+    with _spool_lock:
+        if not os.path.exists(pdf_path):
+            # Write to a scratch file first so a crash never leaves a partial PDF
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+                uploaded_file.seek(0)
+                shutil.copyfileobj(uploaded_file, tmp)
+            os.replace(tmp.name, pdf_path)
+        _spool_refs[pdf_path] = _spool_refs.get(pdf_path, 0) + 1
+
+    return pdf_path
+
+
+def discard_spool(pdf_path):
+    """
+    Release a reference on a spooled PDF, removing the file with the last one.
+    """
+    with _spool_lock:
+        if pdf_path not in _spool_refs:
+            # Never delete a file this table does not know to be unused
+            return
+        _spool_refs[pdf_path] -= 1
+        if _spool_refs[pdf_path] > 0:
+            return
+        del _spool_refs[pdf_path]
+        try:
+            os.unlink(pdf_path)
+        except OSError:
+            # Already gone, or still open elsewhere on Windows; a later
+            # upload of the same file simply reuses it
+            pass
+
+
+def render_page(page, dpi):
+    """
+    Render a page to an RGB pixmap at the given resolution.
+    """
+    mat = fitz.Matrix(dpi / 72, dpi / 72)  # Scale factor for DPI
+    return page.get_pixmap(matrix=mat)
+
+
+def image_pdf_page_range(pdf_path, start, stop, dpi, jpeg_quality):
+    """
+    Build an image-only PDF of pages ``start`` to ``stop``.
+
+    Runs in a worker process, so it opens its own document: PyMuPDF objects
+    can neither be shared across threads nor pickled. Compressing the images
+    here keeps that work parallel and sends back a small PDF, not raw pixels.
+    """
+    with fitz.open(pdf_path) as pdf_document, fitz.open() as output_document:
+        for page_num in range(start, stop):
+            page = pdf_document.load_page(page_num)
+            pix = render_page(page, dpi)
+
+            # Pages without any colour (e.g. plain text) only need one channel
+            gray_pix = fitz.Pixmap(fitz.csGRAY, pix)
+            if fitz.Pixmap(fitz.csRGB, gray_pix).samples == pix.samples:
+                pix = gray_pix
+
+            # Place the image on a page of the same size as the original
+            image_page = output_document.new_page(
+                width=page.rect.width, height=page.rect.height
+            )
+            if jpeg_quality is None:
+                image_page.insert_image(image_page.rect, pixmap=pix)
+            else:
+                # JPEG streams are embedded as they are, without re-encoding
+                image_page.insert_image(
+                    image_page.rect,
+                    stream=pix.tobytes("jpeg", jpg_quality=jpeg_quality),
+                )
+
+        return output_document.tobytes(deflate=True)
+
+
+def worker_count():
+    """
+    Number of worker processes to render with, capped at ``_MAX_WORKERS``.
+
+    Counts the CPUs this process may run on where the platform exposes its
+    affinity mask, rather than every CPU on the host.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return max(1, min(_MAX_WORKERS, cpus))
+
+
+def _get_process_pool():
+    """
+    Return the worker pool shared by every conversion in every session.
+
+    Workers are spawned rather than forked, so the multi-threaded Streamlit
+    server is never copied, and they start once and are then reused.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=worker_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def map_page_ranges(worker, pdf_path, page_count, *args):
+    """
+    Run ``worker(pdf_path, start, stop, *args)`` over contiguous page ranges,
+    spreading them over the shared worker pool, and return the results in
+    page order.
+    """
+    global _process_pool
+    # A handful of pages per range keeps opening the document in each worker
+    # cheap next to the rendering itself
+    workers = max(1, min(worker_count(), page_count // 4))
+    bounds = [page_count * i // workers for i in range(workers + 1)]
+
+    if workers == 1:
+        return [worker(pdf_path, 0, page_count, *args)]
+
+    process_pool = _get_process_pool()
+    try:
+        return list(
+            process_pool.map(
+                worker,
+                [pdf_path] * workers,
+                bounds[:-1],
+                bounds[1:],
+                *([arg] * workers for arg in args),
+            )
+        )
+    except BrokenProcessPool:
+        # A crashed worker breaks the pool for good, start a fresh one next time
+        with _process_pool_lock:
+            if _process_pool is process_pool:
+                _process_pool = None
+        raise
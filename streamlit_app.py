@@ -1,49 +1,77 @@
 import streamlit as st
-import io
-from pypdf import PdfReader, PdfWriter
+import os
+import secrets
+import weakref
 import fitz  # PyMuPDF
-from PIL import Image
+from pdf_helpers import (
+    discard_spool,
+    image_pdf_page_range,
+    map_page_ranges,
+    render_page,
+    spool_upload,
+)
 
 
-def flatten_pdf(pdf_bytes):
+class _SessionSpool:
     """
-    Flatten a PDF by removing form fields and making them part of the content.
+    A session's reference on the spooled copy of its uploaded PDF.
+
+    Kept in ``st.session_state``. The reference is released when the upload
+    is replaced or cleared, or at the latest when the session ends and
+    Streamlit drops its state.
     """
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
 
-    for page in reader.pages:
-        # Flatten the page by merging form fields into the content
-        if "/Annots" in page:
-            page.merge_page(page)
-        writer.add_page(page)
+    def __init__(self, uploaded_file):
+        self.file_id = uploaded_file.file_id
+        self.path = spool_upload(uploaded_file)
+        self._finalizer = weakref.finalize(self, discard_spool, self.path)
 
-    # Create output buffer
-    output_buffer = io.BytesIO()
-    writer.write(output_buffer)
-    output_buffer.seek(0)
-    return output_buffer.getvalue()
+    def discard(self):
+        self._finalizer()
 
 
-def restrict_copying_pdf(
-    pdf_bytes, allow_interactive=False, allow_text_selection=False
-):
+@st.cache_data(max_entries=16)
+def get_page_count(pdf_path):
     """
-    Create a copy-protected PDF with granular permission controls.
+    Count the pages of a PDF.
+
+    PyMuPDF documents must not be shared between the script threads of
+    different sessions, so this opens a short-lived one. Only the xref and
+    page tree are read.
 
     Args:
-        pdf_bytes: The original PDF bytes
-        allow_interactive: Whether to allow interactive elements (links, forms)
-        allow_text_selection: Whether to allow text selection and copying
+        pdf_path: Path to the spooled original PDF
+
+    Returns:
+        Number of pages in the PDF
     """
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
+    with fitz.open(pdf_path) as pdf_document:
+        return pdf_document.page_count
+
+
+@st.cache_data(max_entries=16)
+def flatten_pdf(pdf_path):
+    """
+    Flatten a PDF by removing form fields and making them part of the content.
+
+    Args:
+        pdf_path: Path to the spooled original PDF
+
+    Returns:
+        bytes of the flattened PDF
+    """
+    # Open a private copy, baking mutates the document
+    with fitz.open(pdf_path) as pdf_document:
+        # Render annotation and form field appearances into the page content
+        pdf_document.bake(annots=True, widgets=True)
+
+        return pdf_document.tobytes(garbage=1, deflate=True)
 
-    # Add all pages to the writer
-    for page in reader.pages:
-        writer.add_page(page)
 
-    # Build permissions based on user choices
+def _build_permissions(allow_interactive, allow_text_selection):
+    """
+    Build the PDF permission bits for the copy protection choices.
+    """
     permissions = 0
 
     # Always allow printing (high resolution)
@@ -62,77 +90,130 @@ def restrict_copying_pdf(
     # Always allow viewing
     permissions |= 64  # Modify annotations (bit 7) - needed for basic viewing
 
-    # Encrypt with custom permissions
-    owner_password = "owner_protection_key"
-    writer.encrypt(
-        user_password="",  # No password required to open
-        owner_password=owner_password,
-        use_128bit=True,
-        permissions_flag=permissions,
-    )
+    return permissions
+
+
+# Every combination of the two checkboxes, computed once at import time
+_PERM_TABLE = {
+    (i, t): _build_permissions(i, t) for i in (False, True) for t in (False, True)
+}
+
+
+@st.cache_data(max_entries=16)
+def restrict_copying_pdf(
+    pdf_path, owner_password, allow_interactive=False, allow_text_selection=False
+):
+    """
+    Create a copy-protected PDF with granular permission controls.
+
+    Args:
+        pdf_path: Path to the spooled original PDF
+        owner_password: Password required to lift the restrictions
+        allow_interactive: Whether to allow interactive elements (links, forms)
+        allow_text_selection: Whether to allow text selection and copying
 
-    # Create output buffer
-    output_buffer = io.BytesIO()
-    writer.write(output_buffer)
-    output_buffer.seek(0)
-    return output_buffer.getvalue()
+    Returns:
+        bytes of the protected PDF
+    """
+    # Look up the precomputed permission bits for these choices
+    permissions = _PERM_TABLE[(allow_interactive, allow_text_selection)]
+
+    # MuPDF rewrites the document in C, encrypting every string and stream,
+    # so the document tree never passes through Python
+    with fitz.open(pdf_path) as pdf_document:
+        return pdf_document.tobytes(
+            encryption=fitz.PDF_ENCRYPT_AES_128,
+            owner_pw=owner_password,
+            user_pw="",  # No password required to open
+            permissions=permissions,
+        )
 
 
-def convert_to_image_pdf(pdf_bytes, dpi=150, get_images: bool = False):
+@st.cache_data(max_entries=16)
+def convert_to_image_pdf(pdf_path, dpi=150, jpeg_quality=None):
     """
     Convert each PDF page to an image and create a new PDF from those images.
 
     Args:
-        pdf_bytes: The original PDF bytes
+        pdf_path: Path to the spooled original PDF
         dpi: Resolution for the image conversion (default: 150 DPI)
-        get_images: If True, return a list of PIL Image objects instead of PDF bytes (default: False)
+        jpeg_quality: JPEG quality for the page images, or None for lossless
+            images (default: None)
 
     Returns:
-        If get_images is False: bytes of the image-based PDF
-        If get_images is True: list of PIL Image objects
+        bytes of the image-based PDF
     """
-    # Open the PDF with PyMuPDF
-    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    chunks = map_page_ranges(
+        image_pdf_page_range, pdf_path, get_page_count(pdf_path), dpi, jpeg_quality
+    )
+
+    with fitz.open() as output_document:
+        # Stitch the per-worker PDFs together, their streams are already compressed
+        for chunk in chunks:
+            with fitz.open(stream=chunk, filetype="pdf") as chunk_document:
+                output_document.insert_pdf(chunk_document)
 
-    images = []
-    writer = PdfWriter() if not get_images else None
+        # Merge duplicate objects across the chunks, e.g. repeated ICC profiles
+        return output_document.tobytes(garbage=4)
 
-    for page_num in range(pdf_document.page_count):
-        # Get the page
+
+@st.cache_data(max_entries=32, ttl="1h")
+def render_page_image(pdf_path, page_num, dpi=150):
+    """
+    Render a single PDF page to a PNG image.
+
+    Pages are cached one by one, so the gallery only renders the pages it
+    displays and revisiting a page is free. Full-resolution pages are large,
+    so the cache only holds a few gallery windows and expires them.
+
+    Args:
+        pdf_path: Path to the spooled original PDF
+        page_num: Zero-based index of the page to render
+        dpi: Resolution for the image conversion (default: 150 DPI)
+
+    Returns:
+        PNG bytes of the page
+    """
+    with fitz.open(pdf_path) as pdf_document:
         page = pdf_document.load_page(page_num)
+        return render_page(page, dpi).tobytes("png")
+
 
-        # Convert page to image (pixmap)
-        mat = fitz.Matrix(dpi / 72, dpi / 72)  # Scale factor for DPI
-        pix = page.get_pixmap(matrix=mat)
+@st.cache_data(max_entries=256, ttl="1h")
+def render_page_thumbnail(pdf_path, page_num, dpi=72):
+    """
+    Render a low-resolution gallery thumbnail of a single PDF page.
 
-        # Convert to PIL Image using PNG format (lossless)
-        img_data = pix.tobytes("png")
-        img = Image.open(io.BytesIO(img_data))
+    Scanned pages compress far better as JPEG while text pages stay smaller
+    as PNG, so both are encoded and the smaller one is kept.
 
-        if get_images:
-            # Store image in list
-            images.append(img)
-        else:
-            # Create a new PDF page from the image with highest quality
-            img_buffer = io.BytesIO()
-            img.save(img_buffer, format="PDF", quality=95, optimize=False)
-            img_buffer.seek(0)
+    Args:
+        pdf_path: Path to the spooled original PDF
+        page_num: Zero-based index of the page to render
+        dpi: Resolution for the thumbnail (default: 72 DPI)
 
-            # Add the image PDF page to our writer
-            img_reader = PdfReader(img_buffer)
-            writer.add_page(img_reader.pages[0])
+    Returns:
+        PNG or JPEG bytes of the page
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        pix = render_page(pdf_document.load_page(page_num), dpi)
+    return min(pix.tobytes("png"), pix.tobytes("jpeg", jpg_quality=85), key=len)
 
-    # Close the PyMuPDF document
-    pdf_document.close()
 
-    if get_images:
-        return images
-    else:
-        # Create output buffer
-        output_buffer = io.BytesIO()
-        writer.write(output_buffer)
-        output_buffer.seek(0)
-        return output_buffer.getvalue()
+@st.cache_data(max_entries=16)
+def extract_page_text(pdf_path, page_num=0):
+    """
+    Extract the text of a single PDF page.
+
+    Args:
+        pdf_path: Path to the spooled original PDF
+        page_num: Zero-based index of the page (default: the first page)
+
+    Returns:
+        Text content of the page
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        return pdf_document.load_page(page_num).get_text()
 
 
 def main():
@@ -164,12 +245,21 @@ def main():
             st.success(f"✅ Uploaded: {uploaded_file.name}")
             st.caption(f"Size: {uploaded_file.size:,} bytes")
 
-        # Read the PDF
-        pdf_bytes = uploaded_file.read()
+        # Spool the PDF to disk once per upload, dropping the previous spool
+        spooled = st.session_state.get("spooled_pdf")
+        if (
+            spooled is None
+            or spooled.file_id != uploaded_file.file_id
+            or not os.path.exists(spooled.path)
+        ):
+            if spooled is not None:
+                spooled.discard()
+            spooled = _SessionSpool(uploaded_file)
+            st.session_state["spooled_pdf"] = spooled
+        pdf_path = spooled.path
 
         try:
-            reader = PdfReader(io.BytesIO(pdf_bytes))
-            num_pages = len(reader.pages)
+            num_pages = get_page_count(pdf_path)
 
             st.info(f"📊 PDF Info: {num_pages} page(s)")
 
@@ -194,7 +284,7 @@ def main():
                     ):
                         with st.spinner("Flattening PDF..."):
                             try:
-                                flattened_pdf = flatten_pdf(pdf_bytes)
+                                flattened_pdf = flatten_pdf(pdf_path)
                                 st.session_state["flattened_pdf"] = flattened_pdf
                                 st.success("✅ PDF flattened successfully!")
                             except Exception as e:
@@ -221,8 +311,15 @@ def main():
                     ):
                         with st.spinner("Applying copy protection..."):
                             try:
+                                # One random owner password per session, so
+                                # repeated clicks hit the cache
+                                if "owner_password" not in st.session_state:
+                                    st.session_state["owner_password"] = (
+                                        secrets.token_urlsafe(24)
+                                    )
                                 protected_pdf = restrict_copying_pdf(
-                                    pdf_bytes,
+                                    pdf_path,
+                                    st.session_state["owner_password"],
                                     allow_interactive=allow_interactive,
                                     allow_text_selection=allow_text_selection,
                                 )
@@ -271,6 +368,19 @@ def main():
                         help="Higher DPI = better quality but larger file size",
                     )
 
+                    compression_options = {
+                        "Lossless": None,
+                        "JPEG - high (95)": 95,
+                        "JPEG - standard (85)": 85,
+                        "JPEG - small (70)": 70,
+                    }
+                    image_compression = st.selectbox(
+                        "Image PDF Compression",
+                        options=list(compression_options),
+                        index=0,
+                        help="Lossless suits text and drawings; JPEG makes scans and photos much smaller",
+                    )
+
                     col_img1, col_img2 = st.columns(2)
 
                     with col_img2:
@@ -279,17 +389,16 @@ def main():
                             icon=":material/filter:",
                             help="Extract pages as individual images",
                         ):
-                            with st.spinner("Generating images..."):
-                                try:
-                                    page_images = convert_to_image_pdf(
-                                        pdf_bytes, dpi=image_dpi, get_images=True
-                                    )
-                                    st.session_state["page_images"] = page_images
-                                    st.session_state["image_dpi"] = image_dpi
-                                    st.success("✅ Images generated successfully!")
-                                    st.info(f"ℹ️ Generated {len(page_images)} image(s)")
-                                except Exception as e:
-                                    st.error(f"❌ Error generating images: {str(e)}")
+                            # Pages are rendered lazily as the gallery shows them
+                            st.session_state["page_images"] = {
+                                "pdf_path": pdf_path,
+                                "page_count": num_pages,
+                                "dpi": image_dpi,
+                            }
+                            st.success("✅ Image gallery ready!")
+                            st.info(
+                                f"ℹ️ {num_pages} page(s) available, rendered as you browse"
+                            )
 
                     with col_img1:
                         if st.button(
@@ -300,7 +409,11 @@ def main():
                             with st.spinner("Converting pages to images..."):
                                 try:
                                     image_pdf = convert_to_image_pdf(
-                                        pdf_bytes, dpi=image_dpi
+                                        pdf_path,
+                                        dpi=image_dpi,
+                                        jpeg_quality=compression_options[
+                                            image_compression
+                                        ],
                                     )
                                     st.session_state["image_pdf"] = image_pdf
                                     st.session_state["image_dpi"] = image_dpi
@@ -321,7 +434,7 @@ def main():
                 # Download original PDF
                 st.download_button(
                     label="📄 Download Original PDF",
-                    data=pdf_bytes,
+                    data=uploaded_file,
                     file_name=f"original_{uploaded_file.name}",
                     mime="application/pdf",
                 )
@@ -366,15 +479,15 @@ def main():
                     )
 
                 # Display generated images if available
-                if "page_images" in st.session_state:
+                page_images = st.session_state.get("page_images")
+                if page_images and page_images["pdf_path"] == pdf_path:
                     with st.expander(
-                        f"Generated Images Gallery({len(st.session_state['page_images'])} page(s))",
+                        f"Generated Images Gallery({page_images['page_count']} page(s))",
                         icon="🖼️",
                         expanded=False,
                     ):
-                        images = st.session_state["page_images"]
-                        dpi_info = st.session_state.get("image_dpi", "150")
-                        total_pages = len(images)
+                        dpi_info = page_images["dpi"]
+                        total_pages = page_images["page_count"]
 
                         # Page selection controls
                         col_select1, col_select2, col_select3 = st.columns(3)
@@ -409,32 +522,30 @@ def main():
                         end_idx = min(start_idx + pages_to_show, total_pages)
                         pages_to_display = range(start_idx, end_idx)
 
-                        # Create a grid of images with download buttons
-                        cols = st.columns(2)
-                        for display_idx, idx in enumerate(pages_to_display):
-                            img = images[idx]
-                            with cols[display_idx % 2]:
-                                st.image(
-                                    img,
-                                    caption=f"Page {idx + 1} ({dpi_info} DPI)",
-                                    use_container_width=True,
-                                )
+                        # Pages render on first display, which can take a moment
+                        with st.spinner("Rendering pages..."):
+                            # Create a grid of images with download buttons
+                            cols = st.columns(2)
+                            for display_idx, idx in enumerate(pages_to_display):
+                                img = render_page_image(pdf_path, idx, dpi=dpi_info)
+                                with cols[display_idx % 2]:
+                                    # Low-DPI render for display, so full-size pages
+                                    # only go to the browser on download
+                                    st.image(
+                                        render_page_thumbnail(pdf_path, idx),
+                                        caption=f"Page {idx + 1} ({dpi_info} DPI)",
+                                        use_container_width=True,
+                                    )
 
-                                # Create download button for this image
-                                img_buffer = io.BytesIO()
-                                img.save(
-                                    img_buffer, format="PNG", optimize=False, quality=95
-                                )
-                                img_buffer.seek(0)
-
-                                st.download_button(
-                                    label=f"⬇️ Page {idx + 1}",
-                                    data=img_buffer.getvalue(),
-                                    file_name=f"page_{idx + 1:03d}_{dpi_info}dpi.png",
-                                    mime="image/png",
-                                    key=f"img_download_{idx}",
-                                    use_container_width=True,
-                                )
+                                    # Create download button for this image
+                                    st.download_button(
+                                        label=f"⬇️ Page {idx + 1}",
+                                        data=img,
+                                        file_name=f"page_{idx + 1:03d}_{dpi_info}dpi.png",
+                                        mime="image/png",
+                                        key=f"img_download_{idx}",
+                                        use_container_width=True,
+                                    )
 
             with tab_preview:
                 # PDF Preview section
@@ -442,18 +553,16 @@ def main():
 
                 # Show first page as preview (if possible)
                 try:
-                    first_page = reader.pages[0]
-                    if hasattr(first_page, "extract_text"):
-                        text_content = first_page.extract_text()
-                        if text_content.strip():
-                            with st.expander("📖 First Page Text Content"):
-                                st.text_area(
-                                    "Text from first page:", text_content, height=200
-                                )
-                        else:
-                            st.info(
-                                "ℹ️ No extractable text found on the first page (might be image-based)"
+                    text_content = extract_page_text(pdf_path)
+                    if text_content.strip():
+                        with st.expander("📖 First Page Text Content"):
+                            st.text_area(
+                                "Text from first page:", text_content, height=200
                             )
+                    else:
+                        st.info(
+                            "ℹ️ No extractable text found on the first page (might be image-based)"
+                        )
                 except Exception as e:
                     st.warning(f"⚠️ Could not extract preview: {str(e)}")
 
@@ -462,6 +571,9 @@ def main():
             st.info("Please make sure you uploaded a valid PDF file.")
 
     else:
+        if "spooled_pdf" in st.session_state:
+            st.session_state.pop("spooled_pdf").discard()
+
         st.info("👈 Please upload a PDF file in the sidebar to get started")
 
         # Show some help information